@@ -1,14 +1,38 @@
+from __future__ import annotations
 import os
+import re
 import json
+import marshal
+import asyncio
+import functools
+import logging
+import hashlib
 from datetime import date
 from pathlib import Path
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+# slack_sdk and aiohttp are imported where posting happens, so a
+# misconfigured run or a preview of pick_message_for_today() skips them
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
+try:
+    import orjson  # optional: faster parsing straight from bytes
+except ImportError:
+    orjson = None
+logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------
 #  ENVIRONMENT VALUES
 # ---------------------------------------------------------------
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
 CHANNEL_IDS = os.environ.get("SLACK_CHANNEL_IDS", "")  # comma-separated
+# Slack channel IDs (public C…, private G…, DM D…); matched once at import,
+# so separators and whitespace need no separate split/strip pass
+_CHANNEL_ID_RE = re.compile(r"\b[CGD][A-Z0-9]{8,}\b")
+_CHANNELS: tuple[str, ...] = tuple(_CHANNEL_ID_RE.findall(CHANNEL_IDS))
+# Anything left besides separators is not a channel ID and is skipped
+_MALFORMED_CHANNELS = re.sub(
+    r"[\s,]+", " ", _CHANNEL_ID_RE.sub("", CHANNEL_IDS)
+).strip()
 # ---------------------------------------------------------------
 #  CONSTANTS
 # ---------------------------------------------------------------
@@ -16,6 +40,11 @@ CHANNEL_IDS = os.environ.get("SLACK_CHANNEL_IDS", "")  # comma-separated
 ANCHOR_WEEK_START = date(2024, 12, 29)  # Sunday
 # Used only for rotating daily messages within each topic
 ANCHOR_DATE = date(2025, 1, 1)
+# Day ordinals of the anchors, so selectors do plain int arithmetic
+_ANCHOR_WEEK_ORD = ANCHOR_WEEK_START.toordinal()
+_ANCHOR_DATE_ORD = ANCHOR_DATE.toordinal()
+# Retries per post when Slack answers 429; waits out its Retry-After header
+RATE_LIMIT_RETRIES = 3
 # Explicit mapping for WHS custom week numbers
 # After Cold Stress (week 51), we repeat MSD (week 52),
 # and then Eyes on Path (week 53).
@@ -30,36 +59,56 @@ WHS_WEEK_TOPIC_CODES = {
 # ---------------------------------------------------------------
 #  PER-TOPIC EMOJI SETS
 # ---------------------------------------------------------------
-TOPIC_EMOJIS = {
-    "MSD": {   # MSD Prevention
+# Read-only: built once at import and shared, never copied per message
+TOPIC_EMOJIS = MappingProxyType({
+    "MSD": MappingProxyType({   # MSD Prevention
         "header": ":muscle:",
         "title": ":bulb:",
         "footer": "Safe-to-go :safetogo:",
-    },
-    "SFM": {   # Safety Feedback Mechanism
+    }),
+    "SFM": MappingProxyType({   # Safety Feedback Mechanism
         "header": ":speech_balloon:",
         "title": ":busts_in_silhouette:",
         "footer": "Safe-to-go :safetogo:",
-    },
-    "CONV": {  # Conveyor Safety
+    }),
+    "CONV": MappingProxyType({  # Conveyor Safety
         "header": ":package:",
         "title": ":warning:",
         "footer": "Safe-to-go :safetogo:",
-    },
-    "COLD": {  # Cold Stress Prevention
+    }),
+    "COLD": MappingProxyType({  # Cold Stress Prevention
         "header": ":snowflake:",
         "title": ":gloves:",
         "footer": "Safe-to-go :safetogo:",
-    },
-    "EOP": {   # Eyes on Path & Housekeeping
+    }),
+    "EOP": MappingProxyType({   # Eyes on Path & Housekeeping
         "header": ":eyes:",
         "title": ":broom:",
         "footer": "Safe-to-go :safetogo:",
-    },
-}
+    }),
+})
+# Used for any topic code without its own set
+_DEFAULT_EMOJIS = MappingProxyType({
+    "header": ":helmet_with_white_cross:",
+    "title": ":bulb:",
+    "footer": "Safe-to-go :safetogo:",
+})
+# ---------------------------------------------------------------
+#  SLACK MESSAGE LAYOUT
+# ---------------------------------------------------------------
+_SLACK_TEMPLATE = (
+    "{header} *This week's topic: {topic_name}*\n\n"
+    "{title_emoji} *{title}*\n"
+    "{body}\n\n"
+    "{footer}"
+)
 # ---------------------------------------------------------------
 #  PREFIX CLEANER
 # ---------------------------------------------------------------
+@functools.lru_cache(maxsize=256)
+def _fold(s: str) -> str:
+    """Casefolded form of a prefix; topic names and titles repeat daily."""
+    return s.casefold()
 def strip_prefix(text: str, prefix: str) -> str:
     """
     Remove the prefix (topic or title) from the body if repeated.
@@ -68,57 +117,118 @@ def strip_prefix(text: str, prefix: str) -> str:
     if not prefix:
         return text
     t = text.lstrip()
-    if t.lower().startswith(prefix.lower()):
-        t = t[len(prefix):]
-        t = t.lstrip(" :–-")
-        return t.lstrip()
-    return text
+    # Bodies usually repeat the prefix verbatim
+    if t.startswith(prefix):
+        stripped = t.removeprefix(prefix)
+    # Case-insensitive fallback: only fold the leading slice
+    elif t[:len(prefix)].casefold() == _fold(prefix):
+        stripped = t[len(prefix):]
+    else:
+        return text
+    stripped = stripped.lstrip(" :–-")
+    return stripped.lstrip()
 # ---------------------------------------------------------------
 #  LOAD TOPICS JSON
 # ---------------------------------------------------------------
-def load_topics(path: str | Path = "whs_topics.json") -> dict:
-    p = Path(path)
+# whs_topics/index.json holds the topic codes (rotation order) and names;
+# whs_topics/<CODE>.json holds one topic and its messages.
+TOPICS_DIR = Path("whs_topics")
+# Parsed JSON kept for the life of the process: path -> (mtime, data)
+_JSON_CACHE: dict[str, tuple[float, dict]] = {}
+def _load_json(p: Path) -> dict:
+    """
+    Load a JSON file, parsing it at most once per change.
+    A marshal copy is kept next to the JSON (``*.json.cache``) and reused
+    while it is at least as new as the JSON itself.
+    """
     if not p.exists():
         raise SystemExit(f"Topics file not found: {p}")
-    with p.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    mtime = p.stat().st_mtime
+    key = str(p.resolve())
+    cached = _JSON_CACHE.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    data = None
+    cache_path = p.with_suffix(".json.cache")
+    if cache_path.exists() and cache_path.stat().st_mtime >= mtime:
+        try:
+            with cache_path.open("rb") as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            data = None  # unreadable cache, fall back to the JSON
+    if data is None:
+        raw = p.read_bytes()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+        try:
+            with cache_path.open("wb") as f:
+                marshal.dump(data, f)
+        except OSError:
+            pass  # read-only checkout, just skip the cache
+    _JSON_CACHE[key] = (mtime, data)
+    return data
+def load_index(topics_dir: str | Path = TOPICS_DIR) -> dict:
+    """
+    Load the small topics index (codes in rotation order + names).
+    """
+    index = _load_json(Path(topics_dir) / "index.json")
+    if not index.get("codes"):
+        raise ValueError("codes missing in topics index")
+    # Tuple so pick_weekly_code can key its week table on it as-is
+    index["codes"] = tuple(index["codes"])
+    return index
+def load_topic(code: str, topics_dir: str | Path = TOPICS_DIR) -> dict:
+    """
+    Load a single topic (code, name, messages) by its code.
+    """
+    return _load_json(Path(topics_dir) / f"{code}.json")
 # ---------------------------------------------------------------
 #  SELECT WEEKLY TOPIC (SUNDAY–SATURDAY)
 # ---------------------------------------------------------------
-def pick_weekly_topic(topics_json: dict, today: date | None = None) -> dict:
+def pick_weekly_code(index: dict, today: date | None = None) -> str:
     """
-    Choose this week's topic.
+    Choose this week's topic code.
 Compute a custom week number based on ANCHOR_WEEK_START with
        Sunday–Saturday weeks.
 If the custom week number is in WHS_WEEK_TOPIC_CODES, use that
        topic code (e.g., week 48 -> MSD, 49 -> SFM, etc.).
 Otherwise, fall back to simple rotation by modulo across all
-       defined topics.
+       codes in the index.
     """
     if today is None:
         today = date.today()
-    weekly_topics = topics_json.get("weekly_topics", [])
-    if not weekly_topics:
-        raise ValueError("weekly_topics missing in JSON")
+    codes = tuple(index["codes"])
     # 1) Work out week number (Sunday–Saturday) relative to anchor
-    days_since_anchor = (today - ANCHOR_WEEK_START).days
-    week_offset = days_since_anchor // 7
-    custom_week_number = week_offset + 1
-    # 2) Try explicit mapping first
-    mapped_code = WHS_WEEK_TOPIC_CODES.get(custom_week_number)
-    if mapped_code:
-        # Find first topic with that code
-        for topic in weekly_topics:
-            if topic.get("code") == mapped_code:
-                return topic
-        # If mapping code is missing from JSON, fall back to rotation
-        print(
-            f"Warning: week {custom_week_number} mapped to '{mapped_code}' "
-            f"but no such code found in JSON. Falling back to rotation."
-        )
-    # 3) Fallback: simple rotation by modulo
-    idx = custom_week_number % len(weekly_topics)
-    return weekly_topics[idx]
+    days_since_anchor = today.toordinal() - _ANCHOR_WEEK_ORD
+    custom_week_number = days_since_anchor // 7 + 1
+    # 2) Look it up in the baked table; weeks past it just rotate
+    table = _week_table(codes)
+    if 0 <= custom_week_number < len(table):
+        code = table[custom_week_number]
+        mapped_code = WHS_WEEK_TOPIC_CODES.get(custom_week_number)
+        if mapped_code and mapped_code != code:
+            logger.warning(
+                "Week %s mapped to '%s' but no such code found in index. "
+                "Falling back to rotation.",
+                custom_week_number,
+                mapped_code,
+            )
+        return code
+    return codes[custom_week_number % len(codes)]
+@functools.lru_cache(maxsize=8)
+def _week_table(codes: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    Topic code for every custom week number up to the last one in
+    WHS_WEEK_TOPIC_CODES: the explicit mapping where it names a known
+    code, the modulo rotation everywhere else.
+    """
+    table = []
+    for week in range(max(WHS_WEEK_TOPIC_CODES) + 1):
+        code = WHS_WEEK_TOPIC_CODES.get(week)
+        if code not in codes:
+            # Unmapped, or mapped code missing from the index: rotate
+            code = codes[week % len(codes)]
+        table.append(code)
+    return tuple(table)
 # ---------------------------------------------------------------
 #  SELECT DAILY MESSAGE
 # ---------------------------------------------------------------
@@ -131,7 +241,7 @@ def pick_daily_message(topic: dict, today: date | None = None) -> dict:
     messages = topic.get("messages", [])
     if not messages:
         raise ValueError(f"No messages in topic {topic.get('code')}")
-    days_since_anchor = (today - ANCHOR_DATE).days
+    days_since_anchor = today.toordinal() - _ANCHOR_DATE_ORD
     idx = days_since_anchor % len(messages)
     return messages[idx]
 # ---------------------------------------------------------------
@@ -145,53 +255,176 @@ def build_slack_text(topic: dict, message: dict) -> str:
     # Clean up repeats of topic name or title at the start of body
     body = strip_prefix(raw_body, topic_name)
     body = strip_prefix(body, title)
-    emoji_set = TOPIC_EMOJIS.get(
-        code,
-        {
-            "header": ":helmet_with_white_cross:",
-            "title": ":bulb:",
-            "footer": "Safe-to-go :safetogo:",
-        },
-    )
+    emoji_set = TOPIC_EMOJIS.get(code, _DEFAULT_EMOJIS)
     header_emoji = emoji_set["header"]
     title_emoji = emoji_set["title"]
     footer_text = emoji_set["footer"]
-    return (
-        f"{header_emoji} *This week's topic: {topic_name}*\n\n"
-        f"{title_emoji} *{title}*\n"
-        f"{body}\n\n"
-        f"{footer_text}"
-    )
+    return _SLACK_TEMPLATE.format_map({
+        "header": header_emoji,
+        "topic_name": topic_name,
+        "title_emoji": title_emoji,
+        "title": title,
+        "body": body,
+        "footer": footer_text,
+    })
 # ---------------------------------------------------------------
 #  PICK MESSAGE FOR TODAY
 # ---------------------------------------------------------------
+# Same-day message cache: under the user's own cache dir, never a shared
+# temp dir, so other users or checkouts cannot supply the text we post.
+MESSAGE_CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+) / "whs_daily"
+def _message_cache_path(today: date, script_mtime: float) -> Path:
+    """
+    Per-day cache file, keyed on this checkout's topics dir and on the
+    script version (mapping, emojis and template live in the script).
+    """
+    key = f"{TOPICS_DIR.resolve()}|{script_mtime}".encode("utf-8")
+    digest = hashlib.sha256(key).hexdigest()[:16]
+    return MESSAGE_CACHE_DIR / f"msg_{today.isoformat()}_{digest}.txt"
 def pick_message_for_today() -> str:
-    topics_json = load_topics()
+    """
+    Build today's Slack text. The result is also written to a per-day cache
+    file, so a same-day re-run (e.g. a retried post) reads it back instead
+    of redoing the selection, unless the topics or this script have changed.
+    """
     today = date.today()
-    topic = pick_weekly_topic(topics_json, today)
+    script_mtime = Path(__file__).stat().st_mtime
+    cache_path = _message_cache_path(today, script_mtime)
+    try:
+        topic_mtimes = [p.stat().st_mtime for p in TOPICS_DIR.glob("*.json")]
+        # No topic files: skip the cache and let the loaders report it
+        if topic_mtimes and cache_path.stat().st_mtime >= max(
+            script_mtime, *topic_mtimes
+        ):
+            return cache_path.read_text(encoding="utf-8")
+    except OSError:
+        pass  # no cache yet
+    index = load_index()
+    topic = load_topic(pick_weekly_code(index, today))
     message = pick_daily_message(topic, today)
     formatted = build_slack_text(topic, message)
+    try:
+        MESSAGE_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        cache_path.write_text(formatted, encoding="utf-8")
+    except OSError:
+        pass
     return formatted
 # ---------------------------------------------------------------
 #  SEND TO SLACK
 # ---------------------------------------------------------------
+# Slack rejects section blocks whose text exceeds this many characters
+SECTION_TEXT_LIMIT = 3000
+def build_blocks(text: str) -> list[dict] | None:
+    """
+    Wrap the message in a single mrkdwn section block. Returns None when
+    the text is too long for a section, so the post falls back to plain text.
+    """
+    if len(text) > SECTION_TEXT_LIMIT:
+        return None
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": text}}]
+async def _send(
+    client: AsyncWebClient,
+    channel_id: str,
+    text: str,
+    blocks: list[dict] | None,
+) -> None:
+    from slack_sdk.errors import SlackApiError
+    try:
+        # text stays as the notification / fallback rendering of the blocks
+        await client.chat_postMessage(
+            channel=channel_id, text=text, blocks=blocks
+        )
+        logger.info("Sent message to %s", channel_id)
+    except SlackApiError as e:
+        logger.warning(
+            "Slack error for %s: %s", channel_id, e.response.get("error")
+        )
+_CLIENT: AsyncWebClient | None = None
+def _client() -> AsyncWebClient:
+    """
+    Lazily build the one AsyncWebClient used for every post in this process.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        from slack_sdk.web.async_client import AsyncWebClient
+        from slack_sdk.http_retry.builtin_async_handlers import (
+            AsyncRateLimitErrorRetryHandler,
+            async_default_handlers,
+        )
+        _CLIENT = AsyncWebClient(
+            token=SLACK_BOT_TOKEN,
+            retry_handlers=async_default_handlers() + [
+                AsyncRateLimitErrorRetryHandler(
+                    max_retry_count=RATE_LIMIT_RETRIES
+                ),
+            ],
+        )
+    return _CLIENT
+@functools.lru_cache(maxsize=None)
+def _orjson_response_class() -> type:
+    """
+    aiohttp response class whose .json() decodes with orjson. slack_sdk
+    parses every API reply through .json(), so this is the hook for it.
+    """
+    import aiohttp
+    class OrjsonClientResponse(aiohttp.ClientResponse):
+        async def json(self, *, loads=orjson.loads, **kwargs):
+            return await super().json(loads=loads, **kwargs)
+    return OrjsonClientResponse
+async def _post_all(text: str, channels: tuple[str, ...]) -> None:
+    """
+    Post to every channel concurrently over one shared aiohttp session,
+    so the HTTPS connection is reused instead of re-handshaking per channel.
+    """
+    import aiohttp
+    client = _client()
+    # Built once and shared by every channel's payload
+    blocks = build_blocks(text)
+    # An aiohttp session belongs to the running event loop, so it is
+    # attached to the shared client only for the duration of this run.
+    response_class = (
+        _orjson_response_class() if orjson else aiohttp.ClientResponse
+    )
+    # slack_sdk only applies its own timeout to sessions it creates itself
+    timeout = aiohttp.ClientTimeout(total=client.timeout)
+    async with aiohttp.ClientSession(
+        response_class=response_class, timeout=timeout
+    ) as session:
+        client.session = session
+        try:
+            results = await asyncio.gather(
+                *(
+                    _send(client, channel_id, text, blocks)
+                    for channel_id in channels
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            client.session = None
+    # Let every channel get its attempt, then surface unexpected failures
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
 def post_to_slack(text: str) -> None:
     if not SLACK_BOT_TOKEN:
         raise SystemExit("Missing SLACK_BOT_TOKEN.")
-    if not CHANNEL_IDS:
+    if _MALFORMED_CHANNELS:
+        logger.warning(
+            "Ignoring malformed entries in SLACK_CHANNEL_IDS: %s",
+            _MALFORMED_CHANNELS,
+        )
+    if not _CHANNELS and not _MALFORMED_CHANNELS:
         raise SystemExit("Missing SLACK_CHANNEL_IDS.")
-    client = WebClient(token=SLACK_BOT_TOKEN)
-    channels = [c.strip() for c in CHANNEL_IDS.split(",") if c.strip()]
-    for channel_id in channels:
-        try:
-            client.chat_postMessage(channel=channel_id, text=text)
-            print(f"Sent message to {channel_id}")
-        except SlackApiError as e:
-            print(f"Slack error for {channel_id}: {e.response.get('error')}")
+    if not _CHANNELS:
+        raise SystemExit("No valid channel IDs in SLACK_CHANNEL_IDS.")
+    asyncio.run(_post_all(text, _CHANNELS))
 # ---------------------------------------------------------------
 #  MAIN
 # ---------------------------------------------------------------
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     text = pick_message_for_today()
     post_to_slack(text)
 if __name__ == "__main__":